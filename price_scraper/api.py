@@ -4,12 +4,20 @@
 此模組提供 RESTful API 介面，用於：
 1. 在多個電商平台搜尋商品
 2. 爬取特定商品頁面的價格資訊
-3. 追蹤非同步爬蟲任務的狀態
+3. 追蹤非同步爬蟲任務的狀態與列出任務
+4. 查詢各主機的自適應併發上限
+5. 串流匯出價格資料供分析使用
 """
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
 from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from uuid import uuid4
+import base64
 from pydantic import BaseModel, HttpUrl
 from .worker import scrape_product_task
 from enum import Enum
@@ -17,6 +25,8 @@ from urllib.parse import quote
 from .scrapers.pchome import PChomeScraper
 from .scrapers.momo import MomoScraper
 from .models import get_db, TaskResult
+from .concurrency import controller
+from .export import ExportFormat, MEDIA_TYPES, stream_export
 import json
 
 app = FastAPI(
@@ -49,6 +59,59 @@ class SearchResult(BaseModel):
     platform: str
     products: List[dict]
 
+class TaskSummary(BaseModel):
+    task_id: str
+    status: str
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+class TaskListResponse(BaseModel):
+    tasks: List[TaskSummary]
+    next_cursor: Optional[str] = None  # 下一頁游標，None 表示已無資料
+
+def submit_scrape_task(db: Session, urls: List[str], notify_email: Optional[str] = None) -> str:
+    """
+    寫入任務資料列後再送出爬蟲任務
+    
+    先寫入資料列可確保工作者更新狀態時資料列已存在，
+    查詢狀態時也不需依賴 Celery 結果後端
+    
+    Args:
+        db: 資料庫連線 session
+        urls: 要爬取的 URL 列表
+        notify_email: 可選的通知 email
+        
+    Returns:
+        任務 ID
+    """
+    task_id = str(uuid4())
+    db.add(TaskResult(id=task_id, status="PENDING", result=None))
+    db.commit()
+
+    try:
+        scrape_product_task.apply_async(args=[urls, notify_email], task_id=task_id)
+    except Exception as e:
+        db_task = db.get(TaskResult, task_id)
+        db_task.status = "FAILURE"
+        db_task.result = {"error": f"送出任務時發生錯誤: {str(e)}"}
+        db.commit()
+        raise
+
+    return task_id
+
+def encode_cursor(created_at: datetime, task_id: str) -> str:
+    """將分頁位置編碼為游標字串"""
+    raw = f"{created_at.isoformat()}|{task_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str):
+    """解碼游標字串，格式錯誤時拋出 ValueError"""
+    try:
+        created_at, task_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(created_at), task_id
+    except Exception:
+        raise ValueError("無效的分頁游標")
+
 @app.post("/search", response_model=ScrapeResponse)
 async def search_products(request: SearchRequest, db: Session = Depends(get_db)):
     """
@@ -80,20 +143,11 @@ async def search_products(request: SearchRequest, db: Session = Depends(get_db))
                 url = f"https://www.momoshop.com.tw/search/searchShop.jsp?keyword={encoded_keyword}"
                 urls.append(url)
 
-        # 創建爬蟲任務
-        task = scrape_product_task.delay(urls, request.notify_email)
-        
-        # 將任務資訊存入資料庫
-        db_task = TaskResult(
-            id=task.id,
-            status="PENDING",
-            result=None
-        )
-        db.add(db_task)
-        db.commit()
+        # 寫入任務資料列並送出爬蟲任務
+        task_id = submit_scrape_task(db, urls, request.notify_email)
         
         return ScrapeResponse(
-            task_id=task.id,
+            task_id=task_id,
             message=f"開始在 {', '.join([p.value for p in platforms])} 搜尋 '{request.keyword}'"
         )
     except Exception as e:
@@ -103,13 +157,16 @@ async def search_products(request: SearchRequest, db: Session = Depends(get_db))
         db.close()
 
 @app.post("/search/sync", response_model=List[SearchResult])
-async def search_products_sync(request: SearchRequest):
+def search_products_sync(request: SearchRequest):
     """
     同步搜尋商品
     
     此端點會同步執行搜尋，可能需要較長時間才會回應
     建議用於測試或少量搜尋
     
+    各平台同時搜尋，請求數受各主機的併發上限控制；
+    以一般函式定義讓 FastAPI 於執行緒池中處理，不會阻塞其他請求
+    
     Args:
         request: 包含關鍵字和目標平台的搜尋請求
         
@@ -117,65 +174,151 @@ async def search_products_sync(request: SearchRequest):
         各平台的搜尋結果列表
     """
     try:
-        results = []
         platforms = [p for p in ECommerce if p != ECommerce.ALL] if ECommerce.ALL in request.platforms else request.platforms
         
-        pchome_scraper = PChomeScraper()
-        momo_scraper = MomoScraper()
+        scrapers = {
+            ECommerce.PCHOME: PChomeScraper(),
+            ECommerce.MOMO: MomoScraper()
+        }
         
-        for platform in platforms:
-            if platform == ECommerce.PCHOME:
-                products = pchome_scraper.search_products(request.keyword)
-                results.append(SearchResult(
-                    platform="pchome",
-                    products=products
-                ))
-            elif platform == ECommerce.MOMO:
-                products = momo_scraper.search_products(request.keyword)
-                results.append(SearchResult(
-                    platform="momo",
-                    products=products
-                ))
+        with ThreadPoolExecutor(max_workers=len(platforms)) as executor:
+            products = list(executor.map(lambda platform: scrapers[platform].search_products(request.keyword), platforms))
         
-        return results
+        return [
+            SearchResult(platform=platform.value, products=platform_products)
+            for platform, platform_products in zip(platforms, products)
+        ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/scrape", response_model=ScrapeResponse)
-async def scrape_products(request: ScrapeRequest):
+async def scrape_products(request: ScrapeRequest, db: Session = Depends(get_db)):
     try:
-        task = scrape_product_task.delay([str(url) for url in request.urls], request.notify_email)
+        task_id = submit_scrape_task(db, [str(url) for url in request.urls], request.notify_email)
         return ScrapeResponse(
-            task_id=task.id,
+            task_id=task_id,
             message="爬蟲任務已開始執行"
         )
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        db.close()
+
+@app.get("/tasks", response_model=TaskListResponse)
+def list_tasks(
+    status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    依建立時間由新到舊列出任務
+    
+    使用 keyset 分頁，以上一頁回傳的 next_cursor 取得下一頁，
+    查詢成本不隨頁數增加
+    
+    Args:
+        status: 僅列出此狀態的任務（如 PENDING、FAILURE）
+        limit: 每頁筆數
+        cursor: 分頁游標
+        db: 資料庫連線 session
+        
+    Returns:
+        任務摘要列表與下一頁游標
+    """
+    try:
+        query = db.query(TaskResult.id, TaskResult.status, TaskResult.created_at, TaskResult.updated_at)
+        if status:
+            query = query.filter(TaskResult.status == status)
+        if cursor:
+            created_at, task_id = decode_cursor(cursor)
+            query = query.filter(tuple_(TaskResult.created_at, TaskResult.id) < tuple_(created_at, task_id))
+
+        rows = query.order_by(TaskResult.created_at.desc(), TaskResult.id.desc()).limit(limit + 1).all()
+        next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+
+        return TaskListResponse(
+            tasks=[
+                TaskSummary(
+                    task_id=row.id,
+                    status=row.status,
+                    created_at=row.created_at,
+                    updated_at=row.updated_at
+                )
+                for row in rows[:limit]
+            ],
+            next_cursor=next_cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        db.close()
 
 @app.get("/task/{task_id}")
 async def get_task_status(task_id: str, db: Session = Depends(get_db)):
     try:
-        # 從資料庫查詢任務狀態
-        db_task = db.query(TaskResult).filter(TaskResult.id == task_id).first()
+        # 每個送出的任務都有資料列，狀態由工作者直接更新
+        db_task = db.get(TaskResult, task_id)
         if not db_task:
             raise HTTPException(status_code=404, detail="Task not found")
         
-        # 如果資料庫中的狀態不是完成狀態，則檢查 Celery 任務狀態
-        if db_task.status not in ["SUCCESS", "FAILURE"]:
-            task = scrape_product_task.AsyncResult(task_id)
-            if task.ready():
-                # 更新資料庫中的任務狀態和結果
-                db_task.status = task.status
-                db_task.result = task.result
-                db.commit()
-        
         return {
             "task_id": task_id,
             "status": db_task.status,
             "result": db_task.result
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        db.close() 
\ No newline at end of file
+        db.close() 
+
+@app.get("/concurrency")
+def get_concurrency_status():
+    """
+    查詢各主機的自適應併發狀態
+    
+    狀態存放於 Redis，包含 Celery 工作者與 API 程序共同記錄的資料；
+    讀取 Redis 為阻塞操作，以一般函式定義讓 FastAPI 於執行緒池中處理
+    
+    Returns:
+        以主機為鍵，包含目前上限、在途請求數、p95 延遲與調整紀錄的字典
+    """
+    try:
+        return controller.snapshot()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/export")
+async def export_prices(
+    format: ExportFormat = ExportFormat.CSV,
+    platform: ECommerce = ECommerce.ALL,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    串流匯出爬取到的商品價格資料
+    
+    資料以伺服器端游標分批讀取並逐塊輸出，適合大量資料的分析匯出
+    
+    Args:
+        format: 輸出格式 (csv/parquet)
+        platform: 目標平台，預設匯出所有平台
+        start: 任務建立時間下限（含）
+        end: 任務建立時間上限（不含）
+        db: 資料庫連線 session，於串流結束時關閉
+        
+    Returns:
+        CSV 或 Parquet 檔案的串流回應
+    """
+    platform_filter = None if platform == ECommerce.ALL else platform.value
+    return StreamingResponse(
+        stream_export(db, format, platform_filter, start, end),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="prices.{format.value}"'}
+    )
@@ -0,0 +1,536 @@
+"""
+自適應併發控制模組
+
+以 AIMD（加法增加、乘法減少）方式為每個主機動態調整同時進行的請求數量：
+1. 延遲與成功率穩定時，逐步提高併發上限
+2. 遇到 429、5xx、連線錯誤或 p95 延遲上升時，立即按比例降低上限
+3. 保留每個主機的上限調整紀錄，供 API 查詢
+
+併發上限、在途請求與調整紀錄存放於 Redis，所有 API 與 Celery 工作者程序共用；
+Redis 無法連線期間退回單一程序內的狀態，並定期重新嘗試連線
+"""
+
+import json
+import math
+import os
+import random
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+from uuid import uuid4
+import redis
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 併發控制配置
+CONCURRENCY_REDIS_URL = os.getenv(
+    "SCRAPER_CONCURRENCY_REDIS_URL",
+    os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+)
+INITIAL_LIMIT = int(os.getenv("SCRAPER_INITIAL_CONCURRENCY", "2"))
+MIN_LIMIT = int(os.getenv("SCRAPER_MIN_CONCURRENCY", "1"))
+MAX_LIMIT = int(os.getenv("SCRAPER_MAX_CONCURRENCY", "16"))
+BACKOFF_RATIO = float(os.getenv("SCRAPER_CONCURRENCY_BACKOFF", "0.5"))
+LATENCY_WINDOW = int(os.getenv("SCRAPER_LATENCY_WINDOW", "20"))
+LATENCY_TOLERANCE = float(os.getenv("SCRAPER_LATENCY_TOLERANCE", "2.0"))
+# p95 需比基準值至少增加此毫秒數才算上升，避免基準值極小時一般抖動就觸發降載
+LATENCY_MIN_DELTA = float(os.getenv("SCRAPER_LATENCY_MIN_DELTA_MS", "50")) / 1000
+
+# 請求名額的租約秒數，程序中斷時名額會在到期後自動釋放
+LEASE_TIMEOUT = 60
+# 單一請求的逾時秒數，需小於租約秒數，讓卡住的主機以錯誤結束並觸發降載
+REQUEST_TIMEOUT = min(float(os.getenv("SCRAPER_REQUEST_TIMEOUT", "20")), LEASE_TIMEOUT / 2)
+# 等待名額時的輪詢間隔秒數，每次未取得名額即加倍（含隨機抖動）直到上限
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 1.0
+# Redis 連線失敗後改用程序內狀態的秒數，期滿後重新嘗試 Redis
+REDIS_RETRY_INTERVAL = float(os.getenv("SCRAPER_CONCURRENCY_REDIS_RETRY", "30"))
+HISTORY_SIZE = 50
+KEY_PREFIX = "scraper:concurrency"
+
+# 視為主機過載的 HTTP 狀態碼（另含所有 5xx）
+THROTTLE_STATUS_CODES = {429}
+
+def _percentile(samples, ratio: float) -> float:
+    """計算樣本的百分位數（最近排名法）"""
+    ordered = sorted(samples)
+    index = max(0, math.ceil(ratio * len(ordered)) - 1)
+    return ordered[index]
+
+def _is_overload(status_code: Any) -> bool:
+    """判斷狀態碼是否代表主機過載或限流"""
+    if not isinstance(status_code, int):
+        return False
+    return status_code in THROTTLE_STATUS_CODES or status_code >= 500
+
+def _change_entry(old_limit: int, new_limit: int, reason: str) -> Dict[str, Any]:
+    return {
+        "time": datetime.utcnow().isoformat(),
+        "old_limit": old_limit,
+        "new_limit": new_limit,
+        "reason": reason
+    }
+
+def _round_ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+class RequestSlot:
+    """單一請求佔用的併發名額，用於回報請求結果"""
+
+    def __init__(self, token: str):
+        self.token = token
+        self.started_at = time.time()
+        self.status_code: Optional[int] = None
+
+class LocalLimiterState:
+    """存放於單一程序記憶體中的主機併發狀態"""
+
+    def __init__(self, host: str, initial_limit: int, history_size: int = HISTORY_SIZE):
+        self.host = host
+        self.limit = float(initial_limit)
+        self.leases = set()
+        self.last_decrease_at = 0.0
+        self.stats: Dict[str, Optional[float]] = {"p95": None, "baseline_p95": None}
+        self.history = deque(maxlen=history_size)
+        self._condition = threading.Condition()
+
+    def holds(self, token: str) -> bool:
+        """名額是否由此狀態發出"""
+        with self._condition:
+            return token in self.leases
+
+    def try_acquire(self, token: str) -> bool:
+        with self._condition:
+            if len(self.leases) >= int(self.limit):
+                return False
+            self.leases.add(token)
+            return True
+
+    def wait(self, timeout: float) -> None:
+        """等待名額歸還，最多 timeout 秒"""
+        with self._condition:
+            self._condition.wait(timeout)
+
+    def release(self, token: str) -> int:
+        """歸還名額，回傳歸還前的在途請求數"""
+        with self._condition:
+            in_flight = len(self.leases)
+            self.leases.discard(token)
+            self._condition.notify_all()
+            return in_flight
+
+    def get_limit(self) -> float:
+        with self._condition:
+            return self.limit
+
+    def update_limit(
+        self,
+        compute: Callable[[float], float],
+        reason: str,
+        decrease_started_at: Optional[float] = None
+    ) -> None:
+        """
+        以 compute 計算新的上限
+
+        decrease_started_at 不為 None 時視為降載，
+        早於上次降載就已送出的請求不會再次觸發降載
+        """
+        with self._condition:
+            if decrease_started_at is not None:
+                if decrease_started_at < self.last_decrease_at:
+                    return
+                self.last_decrease_at = time.time()
+            old_limit = int(self.limit)
+            self.limit = compute(self.limit)
+            if int(self.limit) != old_limit:
+                self.history.append(_change_entry(old_limit, int(self.limit), reason))
+                logger.info(f"調整主機併發上限: {self.host} {old_limit} -> {int(self.limit)} ({reason})")
+
+    def record_stats(self, p95: float, baseline_p95: float) -> None:
+        with self._condition:
+            self.stats = {"p95": p95, "baseline_p95": baseline_p95}
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "limit": int(self.limit),
+                "in_flight": len(self.leases),
+                "p95_ms": _round_ms(self.stats["p95"]),
+                "baseline_p95_ms": _round_ms(self.stats["baseline_p95"]),
+                "history": list(self.history)
+            }
+
+class RedisLimiterState:
+    """
+    存放於 Redis 的主機併發狀態，供多個程序共用
+
+    在途請求以 sorted set 記錄租約到期時間，
+    上限的讀取與更新皆以 WATCH / MULTI 交易確保一致
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        host: str,
+        initial_limit: int,
+        history_size: int = HISTORY_SIZE
+    ):
+        self.client = client
+        self.host = host
+        self.initial_limit = initial_limit
+        self.history_size = history_size
+        self.limit_key = f"{KEY_PREFIX}:{host}:limit"
+        self.leases_key = f"{KEY_PREFIX}:{host}:leases"
+        self.last_decrease_key = f"{KEY_PREFIX}:{host}:last_decrease"
+        self.stats_key = f"{KEY_PREFIX}:{host}:stats"
+        self.history_key = f"{KEY_PREFIX}:{host}:history"
+
+    def _read_limit(self, client) -> float:
+        value = client.get(self.limit_key)
+        return float(value) if value is not None else float(self.initial_limit)
+
+    def try_acquire(self, token: str) -> bool:
+        now = time.time()
+        # 清除逾期的租約，需在 WATCH 前執行以免使自身交易失效
+        self.client.zremrangebyscore(self.leases_key, "-inf", now)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.leases_key, self.limit_key)
+                    if pipe.zcard(self.leases_key) >= int(self._read_limit(pipe)):
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.zadd(self.leases_key, {token: now + LEASE_TIMEOUT})
+                    pipe.sadd(f"{KEY_PREFIX}:hosts", self.host)
+                    pipe.execute()
+                    return True
+                except redis.WatchError:
+                    continue
+
+    def wait(self, timeout: float) -> None:
+        time.sleep(timeout)
+
+    def release(self, token: str) -> int:
+        """歸還名額，回傳歸還前的在途請求數"""
+        with self.client.pipeline() as pipe:
+            pipe.zcard(self.leases_key)
+            pipe.zrem(self.leases_key, token)
+            in_flight, _ = pipe.execute()
+        return in_flight
+
+    def get_limit(self) -> float:
+        return self._read_limit(self.client)
+
+    def update_limit(
+        self,
+        compute: Callable[[float], float],
+        reason: str,
+        decrease_started_at: Optional[float] = None
+    ) -> None:
+        """行為同 LocalLimiterState.update_limit，於 Redis 交易中執行"""
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.limit_key, self.last_decrease_key)
+                    if decrease_started_at is not None:
+                        last_decrease_at = float(pipe.get(self.last_decrease_key) or 0)
+                        if decrease_started_at < last_decrease_at:
+                            pipe.unwatch()
+                            return
+                    old_value = self._read_limit(pipe)
+                    new_value = compute(old_value)
+
+                    pipe.multi()
+                    pipe.set(self.limit_key, new_value)
+                    if decrease_started_at is not None:
+                        pipe.set(self.last_decrease_key, time.time())
+                    if int(new_value) != int(old_value):
+                        entry = _change_entry(int(old_value), int(new_value), reason)
+                        pipe.rpush(self.history_key, json.dumps(entry))
+                        pipe.ltrim(self.history_key, -self.history_size, -1)
+                    pipe.execute()
+                    break
+                except redis.WatchError:
+                    continue
+
+        if int(new_value) != int(old_value):
+            logger.info(f"調整主機併發上限: {self.host} {int(old_value)} -> {int(new_value)} ({reason})")
+
+    def record_stats(self, p95: float, baseline_p95: float) -> None:
+        self.client.hset(self.stats_key, mapping={"p95": p95, "baseline_p95": baseline_p95})
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.client.pipeline() as pipe:
+            pipe.zremrangebyscore(self.leases_key, "-inf", time.time())
+            pipe.get(self.limit_key)
+            pipe.zcard(self.leases_key)
+            pipe.hgetall(self.stats_key)
+            pipe.lrange(self.history_key, 0, -1)
+            _, limit, in_flight, stats, history = pipe.execute()
+        return {
+            "limit": int(float(limit)) if limit is not None else self.initial_limit,
+            "in_flight": in_flight,
+            "p95_ms": _round_ms(float(stats["p95"])) if "p95" in stats else None,
+            "baseline_p95_ms": _round_ms(float(stats["baseline_p95"])) if "baseline_p95" in stats else None,
+            "history": [json.loads(entry) for entry in history]
+        }
+
+class RedisHealth:
+    """記錄 Redis 是否可用，連線失敗後一段時間內不再嘗試"""
+
+    def __init__(self, retry_interval: float = REDIS_RETRY_INTERVAL):
+        self.retry_interval = retry_interval
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return time.time() >= self._down_until
+
+    def mark_down(self, error: Exception) -> None:
+        with self._lock:
+            if self.available():
+                logger.warning(
+                    f"無法連線 Redis，{self.retry_interval:g} 秒內改用程序內的併發狀態: {str(error)}"
+                )
+            self._down_until = time.time() + self.retry_interval
+
+class FailoverLimiterState:
+    """
+    優先使用 Redis 的主機併發狀態
+
+    Redis 操作失敗時改用程序內的狀態，並於 RedisHealth 的重試間隔後重新嘗試；
+    在程序內取得的名額一律歸還至程序內的狀態
+    """
+
+    def __init__(self, shared: RedisLimiterState, local: LocalLimiterState, health: RedisHealth):
+        self.host = shared.host
+        self.shared = shared
+        self.local = local
+        self.health = health
+
+    def _call(self, method: str, *args, **kwargs):
+        if self.health.available():
+            try:
+                return getattr(self.shared, method)(*args, **kwargs)
+            except redis.RedisError as e:
+                self.health.mark_down(e)
+        return getattr(self.local, method)(*args, **kwargs)
+
+    def try_acquire(self, token: str) -> bool:
+        return self._call("try_acquire", token)
+
+    def wait(self, timeout: float) -> None:
+        # 程序內的名額歸還時可提早喚醒，Redis 上的名額則等待至逾時
+        self.local.wait(timeout)
+
+    def release(self, token: str) -> int:
+        if self.local.holds(token):
+            return self.local.release(token)
+        return self._call("release", token)
+
+    def get_limit(self) -> float:
+        return self._call("get_limit")
+
+    def update_limit(self, *args, **kwargs) -> None:
+        self._call("update_limit", *args, **kwargs)
+
+    def record_stats(self, p95: float, baseline_p95: float) -> None:
+        self._call("record_stats", p95, baseline_p95)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return self._call("snapshot")
+
+class AdaptiveLimiter:
+    """
+    單一主機的 AIMD 併發限制器
+
+    成功的請求會讓上限增加 1 / limit（約每輪增加 1），
+    過載訊號則讓上限乘以 backoff_ratio。
+    同一輪中已在途的請求不會重複觸發降載。
+    延遲樣本與 p95 基準值由各程序自行累積，上限與在途請求則存放於共用的 state。
+    """
+
+    def __init__(
+        self,
+        state,
+        min_limit: int = MIN_LIMIT,
+        max_limit: int = MAX_LIMIT,
+        backoff_ratio: float = BACKOFF_RATIO,
+        latency_window: int = LATENCY_WINDOW,
+        latency_tolerance: float = LATENCY_TOLERANCE,
+        latency_min_delta: float = LATENCY_MIN_DELTA
+    ):
+        self.state = state
+        self.host = state.host
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_window = latency_window
+        self.latency_tolerance = latency_tolerance
+        self.latency_min_delta = latency_min_delta
+        self.baseline_p95: Optional[float] = None
+        self._latencies = []
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        """目前的併發上限"""
+        return int(self.state.get_limit())
+
+    def acquire(self) -> RequestSlot:
+        """等待直到有可用的併發名額"""
+        token = uuid4().hex
+        interval = POLL_INTERVAL
+        while not self.state.try_acquire(token):
+            # 指數退避加上抖動，避免大量等待中的執行緒同時輪詢 Redis
+            self.state.wait(interval * random.uniform(0.5, 1.0))
+            interval = min(MAX_POLL_INTERVAL, interval * 2)
+        return RequestSlot(token)
+
+    def release(self, slot: RequestSlot, error: bool = False) -> None:
+        """
+        歸還併發名額並依請求結果調整上限
+
+        Args:
+            slot: acquire 取得的名額
+            error: 請求是否以例外結束（如連線逾時）
+        """
+        latency = time.time() - slot.started_at
+        in_flight = self.state.release(slot.token)
+
+        if error:
+            self._decrease(slot, "request error")
+        elif _is_overload(slot.status_code):
+            self._decrease(slot, f"status {slot.status_code}")
+        else:
+            self._record_latency(slot, latency)
+            # 在途請求達上限一半以上時才增加，避免閒置時上限無限制成長
+            if in_flight * 2 >= self.state.get_limit():
+                self.state.update_limit(lambda limit: min(self.max_limit, limit + 1 / limit), "healthy")
+
+    def _record_latency(self, slot: RequestSlot, latency: float) -> None:
+        """累積延遲樣本，每滿一個視窗即比較 p95 與基準值"""
+        with self._lock:
+            self._latencies.append(latency)
+            if len(self._latencies) < self.latency_window:
+                return
+
+            p95 = _percentile(self._latencies, 0.95)
+            self._latencies = []
+
+            if self.baseline_p95 is None:
+                self.baseline_p95 = p95
+                rising = False
+            else:
+                rising = (
+                    p95 > self.baseline_p95 * self.latency_tolerance
+                    and p95 - self.baseline_p95 > self.latency_min_delta
+                )
+                # 基準值緩慢跟隨，讓主機長期變慢時不會無止盡地降載
+                self.baseline_p95 += (p95 - self.baseline_p95) * 0.2
+            baseline_p95 = self.baseline_p95
+
+        self.state.record_stats(p95, baseline_p95)
+        if rising:
+            self._decrease(slot, f"p95 latency {p95 * 1000:.0f}ms")
+
+    def _decrease(self, slot: RequestSlot, reason: str) -> None:
+        with self._lock:
+            self._latencies = []
+        self.state.update_limit(
+            lambda limit: max(self.min_limit, limit * self.backoff_ratio),
+            reason,
+            decrease_started_at=slot.started_at
+        )
+
+    def snapshot(self) -> Dict[str, Any]:
+        """取得目前的併發狀態"""
+        return self.state.snapshot()
+
+class ConcurrencyController:
+    """
+    依主機管理 AdaptiveLimiter 的集合
+
+    提供 redis_url 時各主機狀態存放於 Redis，供所有程序共用；
+    未提供時，或 Redis 暫時無法連線期間，使用程序內的狀態
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        initial_limit: int = INITIAL_LIMIT,
+        redis_retry_interval: float = REDIS_RETRY_INTERVAL,
+        **limiter_options
+    ):
+        # from_url 不會立即連線，實際連線於第一次操作時建立
+        self._redis: Optional[redis.Redis] = redis.Redis.from_url(
+            redis_url,
+            decode_responses=True,
+            socket_connect_timeout=1,
+            socket_timeout=1
+        ) if redis_url else None
+        self._health = RedisHealth(redis_retry_interval)
+        self._initial_limit = initial_limit
+        self._limiter_options = limiter_options
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+        self._lock = threading.Lock()
+
+    def _make_state(self, host: str):
+        local = LocalLimiterState(host, self._initial_limit)
+        if self._redis is None:
+            return local
+        return FailoverLimiterState(RedisLimiterState(self._redis, host, self._initial_limit), local, self._health)
+
+    def limiter_for(self, url: str) -> AdaptiveLimiter:
+        """取得 URL 所屬主機的限制器，不存在時建立"""
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = AdaptiveLimiter(self._make_state(host), **self._limiter_options)
+            return self._limiters[host]
+
+    @contextmanager
+    def slot(self, url: str):
+        """
+        在主機的併發上限內執行請求
+
+        使用方式：
+            with controller.slot(url) as slot:
+                response = session.get(url)
+                slot.status_code = response.status_code
+        """
+        limiter = self.limiter_for(url)
+        slot = limiter.acquire()
+        try:
+            yield slot
+        except Exception:
+            limiter.release(slot, error=True)
+            raise
+        else:
+            limiter.release(slot)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """取得所有主機的併發狀態，使用 Redis 時包含其他程序記錄的主機"""
+        with self._lock:
+            states = {host: limiter.state for host, limiter in self._limiters.items()}
+        if self._redis is not None and self._health.available():
+            try:
+                hosts = self._redis.smembers(f"{KEY_PREFIX}:hosts")
+            except redis.RedisError as e:
+                self._health.mark_down(e)
+                hosts = set()
+            for host in hosts:
+                if host not in states:
+                    states[host] = self._make_state(host)
+        return {host: state.snapshot() for host, state in sorted(states.items())}
+
+# 全域共用的併發控制器
+controller = ConcurrencyController(redis_url=CONCURRENCY_REDIS_URL)
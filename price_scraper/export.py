@@ -0,0 +1,263 @@
+"""
+價格資料匯出模組
+
+將 TaskResult 中的爬蟲結果攤平成商品列，並以串流方式分批輸出：
+1. 支援 CSV 與 Parquet（欄式）格式
+2. 可依平台與建立時間區間篩選
+3. 透過伺服器端游標逐批讀取，記憶體用量不隨資料量成長
+
+命令列使用方式：
+    python -m price_scraper.export --format parquet --platform momo \\
+        --start 2025-01-01 --end 2025-02-01 --output prices.parquet
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+from enum import Enum
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import String, cast
+from sqlalchemy.orm import Session
+from .models import SessionLocal, TaskResult
+from .utils import parse_url
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 匯出配置
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "50000"))
+
+class ExportFormat(str, Enum):
+    """支援的匯出格式列舉"""
+    CSV = "csv"
+    PARQUET = "parquet"
+
+MEDIA_TYPES = {
+    ExportFormat.CSV: "text/csv",
+    ExportFormat.PARQUET: "application/vnd.apache.parquet"
+}
+
+EXPORT_SCHEMA = pa.schema([
+    ("task_id", pa.string()),
+    ("created_at", pa.timestamp("us")),
+    ("platform", pa.string()),
+    ("product_id", pa.string()),
+    ("name", pa.string()),
+    ("price", pa.string()),
+    ("url", pa.string())
+])
+
+COLUMNS = EXPORT_SCHEMA.names
+
+def flatten_task_result(task_id: str, created_at: datetime, result: Any) -> Iterator[Dict[str, Any]]:
+    """
+    將單一任務結果攤平成商品列
+
+    搜尋任務的 data 為商品列表，商品頁任務的 data 為單一商品；
+    含有 error 的項目會被略過
+
+    Args:
+        task_id: 任務 ID
+        created_at: 任務建立時間
+        result: TaskResult.result 的內容
+
+    Yields:
+        以 COLUMNS 為鍵的商品資料
+    """
+    if not isinstance(result, list):
+        return
+
+    for entry in result:
+        if not isinstance(entry, dict) or "data" not in entry:
+            continue
+
+        url_info = parse_url(entry.get("url", ""))
+        data = entry["data"]
+        products = data if isinstance(data, list) else [data]
+
+        for product in products:
+            if not isinstance(product, dict) or "error" in product:
+                continue
+            yield {
+                "task_id": task_id,
+                "created_at": created_at,
+                "platform": url_info["platform"],
+                "product_id": product.get("id") or ("" if url_info["is_search"] else url_info["keyword"]),
+                "name": product.get("name"),
+                "price": product.get("price"),
+                "url": product.get("url")
+            }
+
+def iter_product_rows(
+    db: Session,
+    platform: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    以伺服器端游標逐批讀取成功任務並產生商品列
+
+    平台篩選以 Python 逐列判斷為準；SQL 端僅以結果文字是否包含平台名稱粗篩，
+    此條件無法使用索引，也可能因商品名稱提及平台而誤中，
+    同時包含多個平台的任務（如搜尋全部平台）仍需全部讀出
+
+    Args:
+        db: 資料庫連線 session
+        platform: 僅輸出此平台的商品，None 表示全部
+        start: 建立時間下限（含）
+        end: 建立時間上限（不含）
+
+    Yields:
+        以 COLUMNS 為鍵的商品資料
+    """
+    query = db.query(TaskResult.id, TaskResult.created_at, TaskResult.result).filter(
+        TaskResult.status == "SUCCESS"
+    )
+    if start is not None:
+        query = query.filter(TaskResult.created_at >= start)
+    if end is not None:
+        query = query.filter(TaskResult.created_at < end)
+    if platform is not None:
+        # 粗篩：結果中完全沒有平台名稱的任務不可能產生該平台的商品列
+        query = query.filter(cast(TaskResult.result, String).contains(platform))
+
+    # yield_per 會啟用 stream_results，PostgreSQL 上即為伺服器端游標
+    for task_id, created_at, result in query.order_by(TaskResult.created_at).yield_per(EXPORT_FETCH_SIZE):
+        for row in flatten_task_result(task_id, created_at, result):
+            if platform is None or row["platform"] == platform:
+                yield row
+
+def _chunked(rows: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    """將商品列分批"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def stream_csv(rows: Iterator[Dict[str, Any]], chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """將商品列轉為 CSV 位元組區塊"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+    writer.writeheader()
+
+    for chunk in _chunked(rows, chunk_rows):
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+
+    # 沒有任何資料時仍輸出標題列
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+class _ChunkSink:
+    """
+    供 ParquetWriter 寫入的暫存輸出
+
+    Parquet 檔尾記錄的是各 row group 的絕對位移，
+    因此 tell 需回傳累計寫入量，而非暫存區內的位置
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        """取出並清空目前暫存的資料"""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_parquet(rows: Iterator[Dict[str, Any]], chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """將商品列轉為 Parquet 位元組區塊，每批資料為一個 row group"""
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), EXPORT_SCHEMA, compression="zstd")
+    try:
+        for chunk in _chunked(rows, chunk_rows):
+            writer.write_batch(pa.RecordBatch.from_pylist(chunk, schema=EXPORT_SCHEMA))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def stream_export(
+    db: Session,
+    export_format: ExportFormat = ExportFormat.CSV,
+    platform: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> Iterator[bytes]:
+    """
+    以指定格式串流輸出價格資料，結束時關閉資料庫連線
+
+    Args:
+        db: 資料庫連線 session
+        export_format: 輸出格式
+        platform: 僅輸出此平台的商品，None 表示全部
+        start: 建立時間下限（含）
+        end: 建立時間上限（不含）
+
+    Yields:
+        檔案內容的位元組區塊
+    """
+    try:
+        rows = iter_product_rows(db, platform, start, end)
+        if export_format == ExportFormat.PARQUET:
+            yield from stream_parquet(rows)
+        else:
+            yield from stream_csv(rows)
+    finally:
+        db.close()
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """命令列匯出入口"""
+    parser = argparse.ArgumentParser(description="匯出爬蟲取得的商品價格資料")
+    parser.add_argument("--format", choices=[f.value for f in ExportFormat], default=ExportFormat.CSV.value)
+    parser.add_argument("--platform", choices=["pchome", "momo"], default=None)
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None, help="建立時間下限 (ISO 8601)")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None, help="建立時間上限 (ISO 8601)")
+    parser.add_argument("--output", "-o", default="-", help="輸出檔案路徑，預設為標準輸出")
+    args = parser.parse_args(argv)
+
+    chunks = stream_export(SessionLocal(), ExportFormat(args.format), args.platform, args.start, args.end)
+    if args.output == "-":
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+    else:
+        with open(args.output, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        logger.info(f"匯出完成: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+資料庫管理指令模組
+
+提供需手動執行一次的維護步驟，不在各程序匯入模組時自動執行：
+1. create-indexes: 為既有的 task_results 資料表補建索引
+
+命令列使用方式：
+    python -m price_scraper.manage create-indexes
+"""
+
+import argparse
+import logging
+from typing import List, Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from .models import engine, TaskResult
+
+# 設定日誌
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def create_indexes(bind: Engine = engine) -> List[str]:
+    """
+    為 task_results 補建模型中定義的索引
+
+    PostgreSQL 上使用 CREATE INDEX CONCURRENTLY，建立期間不會阻擋寫入；
+    此語法不能在交易中執行，因此以 AUTOCOMMIT 連線逐一建立。
+    若建立中斷會留下 INVALID 索引，需先 DROP INDEX 再重新執行
+
+    Args:
+        bind: 資料庫引擎
+
+    Returns:
+        執行的 SQL 語句列表
+    """
+    concurrently = "CONCURRENTLY " if bind.dialect.name == "postgresql" else ""
+    table = TaskResult.__table__
+    statements = []
+
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            columns = ", ".join(column.name for column in index.columns)
+            statement = f"CREATE INDEX {concurrently}IF NOT EXISTS {index.name} ON {table.name} ({columns})"
+            logger.info(f"建立索引: {statement}")
+            conn.execute(text(statement))
+            statements.append(statement)
+
+    return statements
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """命令列管理入口"""
+    parser = argparse.ArgumentParser(description="資料庫管理指令")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("create-indexes", help="為既有資料表補建索引")
+    args = parser.parse_args(argv)
+
+    if args.command == "create-indexes":
+        create_indexes()
+
+if __name__ == "__main__":
+    main()
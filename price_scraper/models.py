@@ -4,7 +4,7 @@
 定義資料庫表格結構和連線管理
 """
 
-from sqlalchemy import Column, Integer, String, JSON, DateTime, create_engine
+from sqlalchemy import Column, Integer, String, JSON, DateTime, Index, create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 import os
@@ -48,12 +48,18 @@ class TaskResult(Base):
     
     __tablename__ = "task_results"
 
+    __table_args__ = (
+        # 依狀態列出最近任務時使用（如 pending / failed 任務列表）
+        Index("ix_task_results_status_created_at", "status", "created_at"),
+    )
+
     id = Column(String, primary_key=True, comment="任務 ID")
     status = Column(String, nullable=False, comment="任務狀態")
     result = Column(JSON, nullable=True, comment="任務結果")
     created_at = Column(
         DateTime,
         default=datetime.utcnow,
+        index=True,
         comment="建立時間"
     )
     updated_at = Column(
@@ -66,8 +72,32 @@ class TaskResult(Base):
     def __repr__(self):
         return f"<TaskResult(id={self.id}, status={self.status})>"
 
+class TaskResultArchive(Base):
+    """
+    爬蟲任務結果封存表
+    
+    保留期限過後的任務結果於啟用封存時移至此表
+    """
+    
+    __tablename__ = "task_results_archive"
+
+    id = Column(String, primary_key=True, comment="任務 ID")
+    status = Column(String, nullable=False, comment="任務狀態")
+    result = Column(JSON, nullable=True, comment="任務結果")
+    created_at = Column(DateTime, comment="建立時間")
+    updated_at = Column(DateTime, comment="更新時間")
+    archived_at = Column(
+        DateTime,
+        default=datetime.utcnow,
+        comment="封存時間"
+    )
+
+    def __repr__(self):
+        return f"<TaskResultArchive(id={self.id}, status={self.status})>"
+
 # 建立資料表
 try:
+    # create_all 不會為既有資料表補建索引，請執行 python -m price_scraper.manage create-indexes
     Base.metadata.create_all(bind=engine)
     logger.info("資料表建立成功")
 except Exception as e:
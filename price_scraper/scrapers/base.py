@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 import requests
 from ..utils import create_connection
+from ..concurrency import controller, REQUEST_TIMEOUT
 
 class BaseScraper(ABC):
     def __init__(self):
@@ -8,6 +9,15 @@ class BaseScraper(ABC):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        self.concurrency = controller
+        self.timeout = REQUEST_TIMEOUT
+    
+    def _get(self, url):
+        """在主機的自適應併發上限內送出 GET 請求"""
+        with self.concurrency.slot(url) as slot:
+            response = self.session.get(url, headers=self.headers, timeout=self.timeout)
+            slot.status_code = response.status_code
+        return response
     
     @abstractmethod
     def search_products(self, keyword):
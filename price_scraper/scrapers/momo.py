@@ -14,7 +14,7 @@ class MomoScraper(BaseScraper):
         url = f"{self.base_url}?i_code={product_id}"
         
         try:
-            response = self.session.get(url, headers=self.headers)
+            response = self._get(url)
             response.raise_for_status()
             soup = BeautifulSoup(response.text, "html.parser")
             
@@ -38,7 +38,7 @@ class MomoScraper(BaseScraper):
         search_url = f"https://www.momoshop.com.tw/search/searchShop.jsp?keyword={keyword}"
         
         try:
-            response = self.session.get(search_url, headers=self.headers)
+            response = self._get(search_url)
             response.raise_for_status()
             soup = BeautifulSoup(response.text, "html.parser")
             
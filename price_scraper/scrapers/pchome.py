@@ -12,7 +12,7 @@ class PChomeScraper(BaseScraper):
         url = self.base_url + product_id
         
         try:
-            response = self.session.get(url, headers=self.headers)
+            response = self._get(url)
             response.raise_for_status()
             soup = BeautifulSoup(response.text, "html.parser")
             
@@ -36,7 +36,7 @@ class PChomeScraper(BaseScraper):
         search_url = f"https://24h.pchome.com.tw/search/?q={keyword}"
         
         try:
-            response = self.session.get(search_url, headers=self.headers)
+            response = self._get(search_url)
             response.raise_for_status()
             soup = BeautifulSoup(response.text, "html.parser")
             
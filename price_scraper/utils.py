@@ -1,6 +1,8 @@
 import random
 import time
 import requests
+from typing import Dict
+from urllib.parse import urlparse, parse_qs
 
 user_agents = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
@@ -29,4 +31,33 @@ def create_connection():
     session = requests.Session()
     time.sleep(random.uniform(1, 3))
     
-    return session, headers 
\ No newline at end of file
+    return session, headers 
+
+def parse_url(url: str) -> Dict[str, str]:
+    """
+    解析 URL 取得平台和關鍵資訊
+    
+    Args:
+        url: 目標 URL
+        
+    Returns:
+        包含平台和查詢參數的字典
+    """
+    parsed = urlparse(url)
+    params = parse_qs(parsed.query)
+    
+    if "pchome" in parsed.netloc:
+        platform = "pchome"
+        keyword = params.get("q", [""])[0] if "search" in parsed.path else parsed.path.split("/prod/")[-1]
+    elif "momo" in parsed.netloc:
+        platform = "momo"
+        keyword = params.get("keyword", [""])[0] if "search" in parsed.path else params.get("i_code", [""])[0]
+    else:
+        platform = "unknown"
+        keyword = ""
+        
+    return {
+        "platform": platform,
+        "keyword": keyword,
+        "is_search": "search" in parsed.path
+    }
\ No newline at end of file
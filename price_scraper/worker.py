@@ -4,17 +4,26 @@ Celery 工作者模組
 處理非同步爬蟲任務，支援：
 1. 多平台商品搜尋
 2. 單一商品資訊爬取
-3. 任務結果儲存
+3. 依主機併發上限同時爬取多個 URL
+4. 任務結果儲存
+5. 過期任務結果的分批清除與封存
 """
 
 from celery import Celery
+from celery.signals import task_failure
 from typing import List, Optional, Dict, Any
 from .scrapers.pchome import PChomeScraper
 from .scrapers.momo import MomoScraper
 import os
+import threading
 import logging
-from .models import SessionLocal, TaskResult
-from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select
+from .models import SessionLocal, TaskResult, TaskResultArchive
+from .concurrency import controller
+from urllib.parse import urlparse
+from .utils import parse_url
 
 # 設定日誌
 logging.basicConfig(level=logging.INFO)
@@ -30,34 +39,116 @@ celery_app = Celery(
     backend=CELERY_RESULT_BACKEND
 )
 
-def parse_url(url: str) -> Dict[str, str]:
+# 任務結果保留配置
+TASK_RESULT_RETENTION_DAYS = int(os.getenv('TASK_RESULT_RETENTION_DAYS', '30'))
+TASK_RESULT_PURGE_BATCH_SIZE = int(os.getenv('TASK_RESULT_PURGE_BATCH_SIZE', '1000'))
+TASK_RESULT_ARCHIVE = os.getenv('TASK_RESULT_ARCHIVE', 'false').lower() == 'true'
+# 只清除已結束的任務，仍在佇列或執行中的任務不受保留期限影響
+TERMINAL_STATUSES = ["SUCCESS", "FAILURE"]
+# 未結束的任務超過此時數未更新即視為遺失（如訊息遺失、容器被強制終止、任務被撤銷）
+TASK_RESULT_STALE_HOURS = int(os.getenv('TASK_RESULT_STALE_HOURS', '24'))
+
+celery_app.conf.beat_schedule = {
+    'purge-task-results': {
+        'task': 'purge_task_results',
+        'schedule': 60 * 60,
+    }
+}
+
+def update_task_result(task_id: str, status: str, result: Optional[List[Dict[str, Any]]] = None) -> None:
+    """
+    更新任務狀態，資料列不存在時建立
+    
+    Args:
+        task_id: 任務 ID
+        status: 任務狀態
+        result: 任務結果
+    """
+    try:
+        with SessionLocal() as db:
+            db_task = db.get(TaskResult, task_id)
+            if db_task is None:
+                db_task = TaskResult(id=task_id)
+                db.add(db_task)
+            db_task.status = status
+            db_task.result = result
+            db.commit()
+            logger.info(f"已更新任務狀態: {task_id} ({status})")
+    except Exception as e:
+        logger.error(f"更新資料庫狀態時發生錯誤: {str(e)}")
+
+# 每個執行緒各自持有爬蟲實例，避免共用 requests.Session
+_thread_local = threading.local()
+
+def get_scrapers() -> Dict[str, Any]:
+    """取得目前執行緒的爬蟲實例"""
+    if not hasattr(_thread_local, "scrapers"):
+        _thread_local.scrapers = {
+            "pchome": PChomeScraper(),
+            "momo": MomoScraper()
+        }
+    return _thread_local.scrapers
+
+def scrape_url(url: str) -> Dict[str, Any]:
     """
-    解析 URL 取得平台和關鍵資訊
+    爬取單一 URL
     
     Args:
         url: 目標 URL
         
     Returns:
-        包含平台和查詢參數的字典
+        包含 url 與 data 或 error 的結果
     """
-    parsed = urlparse(url)
-    params = parse_qs(parsed.query)
+    try:
+        logger.info(f"開始處理 URL: {url}")
+        url_info = parse_url(url)
+        scrapers = get_scrapers()
+        
+        if url_info["platform"] not in scrapers:
+            raise ValueError(f"不支援的平台: {url}")
+            
+        scraper = scrapers[url_info["platform"]]
+        if url_info["is_search"]:
+            result = scraper.search_products(url_info["keyword"])
+        else:
+            result = scraper.fetch_product(url_info["keyword"])
+            
+        logger.info(f"成功處理 URL: {url}")
+        return {
+            "url": url,
+            "data": result
+        }
+        
+    except Exception as e:
+        logger.error(f"處理 URL 時發生錯誤: {url}, 錯誤: {str(e)}")
+        return {
+            "url": url,
+            "error": str(e)
+        }
+
+def scrape_urls(urls: List[str]) -> List[Dict[str, Any]]:
+    """
+    同時爬取多個 URL，結果順序與輸入相同
+    
+    實際的同時請求數由各主機的併發控制器限制，
+    執行緒數量以各主機的上限最大值計算，讓上限提高時不會受限於執行緒數
     
-    if "pchome" in parsed.netloc:
-        platform = "pchome"
-        keyword = params.get("q", [""])[0] if "search" in parsed.path else parsed.path.split("/prod/")[-1]
-    elif "momo" in parsed.netloc:
-        platform = "momo"
-        keyword = params.get("keyword", [""])[0] if "search" in parsed.path else params.get("i_code", [""])[0]
-    else:
-        platform = "unknown"
-        keyword = ""
+    Args:
+        urls: 要爬取的 URL 列表
         
-    return {
-        "platform": platform,
-        "keyword": keyword,
-        "is_search": "search" in parsed.path
-    }
+    Returns:
+        爬取結果列表
+    """
+    if not urls:
+        return []
+
+    first_url_per_host = {urlparse(url).netloc: url for url in reversed(urls)}
+    max_workers = min(
+        len(urls),
+        sum(controller.limiter_for(url).max_limit for url in first_url_per_host.values())
+    )
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(scrape_url, urls))
 
 @celery_app.task(name="scrape_product")
 def scrape_product_task(urls: List[str], notify_email: Optional[str] = None) -> List[Dict[str, Any]]:
@@ -71,49 +162,96 @@ def scrape_product_task(urls: List[str], notify_email: Optional[str] = None) ->
     Returns:
         爬取結果列表
     """
-    results = []
-    scrapers = {
-        "pchome": PChomeScraper(),
-        "momo": MomoScraper()
-    }
+    update_task_result(scrape_product_task.request.id, "STARTED")
+
+    results = scrape_urls(urls)
     
-    for url in urls:
-        try:
-            logger.info(f"開始處理 URL: {url}")
-            url_info = parse_url(url)
-            
-            if url_info["platform"] not in scrapers:
-                raise ValueError(f"不支援的平台: {url}")
-                
-            scraper = scrapers[url_info["platform"]]
-            if url_info["is_search"]:
-                result = scraper.search_products(url_info["keyword"])
-            else:
-                result = scraper.fetch_product(url_info["keyword"])
-                
-            results.append({
-                "url": url,
-                "data": result
-            })
-            logger.info(f"成功處理 URL: {url}")
-            
-        except Exception as e:
-            logger.error(f"處理 URL 時發生錯誤: {url}, 錯誤: {str(e)}")
-            results.append({
-                "url": url,
-                "error": str(e)
-            })
+    update_task_result(scrape_product_task.request.id, "SUCCESS", results)
     
-    try:
-        # 更新資料庫狀態
-        with SessionLocal() as db:
-            db_task = db.query(TaskResult).filter(TaskResult.id == scrape_product_task.request.id).first()
-            if db_task:
-                db_task.status = "SUCCESS"
-                db_task.result = results
-                db.commit()
-                logger.info(f"已更新任務狀態: {scrape_product_task.request.id}")
-    except Exception as e:
-        logger.error(f"更新資料庫狀態時發生錯誤: {str(e)}")
+    return results
+
+@task_failure.connect
+def mark_task_failure(sender=None, task_id: Optional[str] = None, exception: Optional[BaseException] = None, **kwargs) -> None:
+    """
+    爬蟲任務拋出例外或工作者程序中斷時，將資料列標記為 FAILURE
     
-    return results 
\ No newline at end of file
+    工作者程序中斷時此訊號由主程序送出，因此不依賴任務本身的例外處理
+    """
+    if sender is None or sender.name != scrape_product_task.name:
+        return
+    update_task_result(task_id, "FAILURE", {"error": f"任務執行失敗: {exception!r}"})
+
+@celery_app.task(name="purge_task_results")
+def purge_task_results_task(
+    retention_days: int = TASK_RESULT_RETENTION_DAYS,
+    batch_size: int = TASK_RESULT_PURGE_BATCH_SIZE,
+    archive: bool = TASK_RESULT_ARCHIVE,
+    stale_hours: int = TASK_RESULT_STALE_HOURS
+) -> int:
+    """
+    分批刪除超過保留期限且已結束（SUCCESS / FAILURE）的任務結果
+    
+    清除前先將長時間未更新的 PENDING / STARTED 任務標記為 FAILURE，
+    這些任務遺失時不會送出 task_failure 訊號，否則會永遠停留在未結束狀態。
+    每批各自提交交易，避免長時間鎖住資料表
+    
+    Args:
+        retention_days: 保留天數
+        batch_size: 每批處理的筆數
+        archive: 是否在刪除前移至封存表
+        stale_hours: 未結束任務視為遺失的未更新時數
+        
+    Returns:
+        處理的總筆數
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=retention_days)
+    stale_cutoff = now - timedelta(hours=stale_hours)
+    columns = ["id", "status", "result", "created_at", "updated_at"]
+    stale = 0
+    purged = 0
+
+    with SessionLocal() as db:
+        while True:
+            ids = [
+                task_id for (task_id,) in db.query(TaskResult.id)
+                .filter(TaskResult.status.notin_(TERMINAL_STATUSES), TaskResult.updated_at < stale_cutoff)
+                .limit(batch_size)
+            ]
+            if not ids:
+                break
+
+            db.query(TaskResult).filter(TaskResult.id.in_(ids)).update(
+                {
+                    TaskResult.status: "FAILURE",
+                    TaskResult.result: {"error": f"任務超過 {stale_hours} 小時未更新，視為遺失"}
+                },
+                synchronize_session=False
+            )
+            db.commit()
+            stale += len(ids)
+
+        while True:
+            ids = [
+                task_id for (task_id,) in db.query(TaskResult.id)
+                .filter(TaskResult.status.in_(TERMINAL_STATUSES), TaskResult.created_at < cutoff)
+                .order_by(TaskResult.created_at)
+                .limit(batch_size)
+            ]
+            if not ids:
+                break
+
+            if archive:
+                db.execute(
+                    insert(TaskResultArchive).from_select(
+                        columns,
+                        select(*[getattr(TaskResult, column) for column in columns]).where(TaskResult.id.in_(ids))
+                    )
+                )
+            db.query(TaskResult).filter(TaskResult.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+            purged += len(ids)
+
+    logger.info(f"已將 {stale} 筆早於 {stale_cutoff.isoformat()} 未更新的任務標記為 FAILURE")
+    logger.info(f"已{'封存' if archive else '刪除'} {purged} 筆早於 {cutoff.isoformat()} 的任務結果")
+    return purged 
\ No newline at end of file
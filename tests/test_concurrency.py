@@ -0,0 +1,234 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+import redis
+from price_scraper import PChomeScraper
+from price_scraper.concurrency import ConcurrencyController, RequestSlot
+from price_scraper.worker import scrape_urls
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """模擬電商主機的請求處理器，行為由 server.mode 決定"""
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+        try:
+            self.respond()
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def respond(self):
+        mode = self.server.mode
+        if mode == "throttled":
+            self.send_response(429)
+            self.end_headers()
+            return
+        if mode == "error":
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        time.sleep({"slow": 0.2, "hang": 1.0}.get(mode, 0.01))
+        body = '''
+            <div class="o-prodMainName">測試商品</div>
+            <div class="o-prodPrice__price">1000</div>
+        '''.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stand_in_server():
+    """在本機啟動可切換行為的替身主機"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.mode = "healthy"
+    server.lock = threading.Lock()
+    server.active = 0
+    server.peak = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def redis_url():
+    """可連線的測試用 Redis，無法連線時略過測試"""
+    url = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+    client = redis.Redis.from_url(url)
+    try:
+        client.ping()
+    except redis.RedisError:
+        pytest.skip("需要可連線的 Redis")
+    client.flushdb()
+    yield url
+    client.flushdb()
+
+def make_scraper(server, controller):
+    """建立指向替身主機並使用指定併發控制器的 PChomeScraper"""
+    scraper = PChomeScraper()
+    host, port = server.server_address
+    scraper.base_url = f"http://{host}:{port}/prod/"
+    scraper.concurrency = controller
+    return scraper
+
+@pytest.fixture
+def pchome_scraper(stand_in_server):
+    """使用程序內併發狀態的 PChomeScraper"""
+    return make_scraper(stand_in_server, ConcurrencyController(
+        initial_limit=2,
+        max_limit=8,
+        latency_window=10
+    ))
+
+def run_requests(scraper, count, workers=8):
+    """以多執行緒同時送出請求"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(scraper.fetch_product, [f"TEST-{i}" for i in range(count)]))
+
+def host_status(scraper):
+    """取得替身主機的併發狀態"""
+    return next(iter(scraper.concurrency.snapshot().values()))
+
+def test_limit_grows_while_healthy(pchome_scraper):
+    """測試主機回應正常時併發上限逐步提高"""
+    results = run_requests(pchome_scraper, 40)
+
+    assert all(result['name'] == '測試商品' for result in results)
+    status = host_status(pchome_scraper)
+    assert status['limit'] > 2
+    assert status['in_flight'] == 0
+    assert all(change['reason'] == 'healthy' for change in status['history'])
+
+@pytest.mark.parametrize("mode, reason", [("throttled", "status 429"), ("error", "status 503")])
+def test_limit_backs_off_on_overload(stand_in_server, pchome_scraper, mode, reason):
+    """測試主機回應 429 或 5xx 時併發上限降低"""
+    run_requests(pchome_scraper, 40)
+    grown_limit = host_status(pchome_scraper)['limit']
+
+    stand_in_server.mode = mode
+    results = run_requests(pchome_scraper, 8)
+
+    assert all('error' in result for result in results)
+    status = host_status(pchome_scraper)
+    assert status['limit'] < grown_limit
+    assert status['history'][-1]['reason'] == reason
+
+def test_limit_backs_off_on_rising_p95(stand_in_server, pchome_scraper):
+    """測試 p95 延遲明顯上升時併發上限降低"""
+    run_requests(pchome_scraper, 40)
+    grown_limit = host_status(pchome_scraper)['limit']
+
+    stand_in_server.mode = "slow"
+    run_requests(pchome_scraper, 10)
+
+    status = host_status(pchome_scraper)
+    assert status['limit'] < grown_limit
+    assert status['history'][-1]['reason'].startswith('p95 latency')
+    assert status['p95_ms'] > status['baseline_p95_ms']
+
+def test_limit_backs_off_on_timeout(stand_in_server, pchome_scraper):
+    """測試主機回應卡住時請求逾時並降低併發上限"""
+    run_requests(pchome_scraper, 40)
+    grown_limit = host_status(pchome_scraper)['limit']
+
+    stand_in_server.mode = "hang"
+    pchome_scraper.timeout = 0.1
+    results = run_requests(pchome_scraper, 4)
+
+    assert all('error' in result for result in results)
+    status = host_status(pchome_scraper)
+    assert status['limit'] < grown_limit
+    assert status['history'][-1]['reason'] == 'request error'
+
+def test_small_latency_jitter_does_not_back_off():
+    """測試基準值極小時，比例超過容忍倍數但絕對增幅很小的抖動不會降載"""
+    limiter = ConcurrencyController(initial_limit=4, latency_window=10).limiter_for("http://127.0.0.1/")
+    for latency in [0.001] * 10 + [0.005] * 10:
+        limiter._record_latency(RequestSlot("token"), latency)
+
+    assert limiter.limit == 4
+    assert limiter.snapshot()['history'] == []
+
+def test_limit_stays_within_bounds(stand_in_server, pchome_scraper):
+    """測試持續過載時併發上限不低於下限"""
+    stand_in_server.mode = "error"
+    for _ in range(5):
+        run_requests(pchome_scraper, 4)
+
+    assert host_status(pchome_scraper)['limit'] == 1
+
+def test_limit_stays_within_bounds_under_load(stand_in_server, pchome_scraper):
+    """測試替身主機實際收到的同時請求數不超過上限"""
+    pchome_scraper.concurrency = ConcurrencyController(initial_limit=3, max_limit=3)
+    run_requests(pchome_scraper, 30, workers=10)
+
+    assert stand_in_server.peak == 3
+
+def test_scrape_urls_fans_out_under_limit(stand_in_server):
+    """測試爬蟲任務同時處理多個 URL，且不超過主機併發上限"""
+    scraper = make_scraper(stand_in_server, ConcurrencyController(initial_limit=3, max_limit=3))
+    urls = [f"https://24h.pchome.com.tw/prod/TEST-{i}" for i in range(12)]
+
+    with patch('price_scraper.worker.get_scrapers', return_value={"pchome": scraper}):
+        results = scrape_urls(urls)
+
+    assert [result['url'] for result in results] == urls
+    assert all(result['data']['name'] == '測試商品' for result in results)
+    assert stand_in_server.peak == 3
+
+def test_waiting_for_slot_backs_off():
+    """測試等待名額時以指數退避輪詢，而非固定間隔"""
+    limiter = ConcurrencyController(initial_limit=1, max_limit=1).limiter_for("http://127.0.0.1/")
+    held = limiter.acquire()
+    threading.Timer(1.5, limiter.release, args=[held]).start()
+
+    with patch.object(limiter.state, 'try_acquire', wraps=limiter.state.try_acquire) as mock_try_acquire:
+        limiter.release(limiter.acquire())
+
+    # 固定 50ms 輪詢約需 30 次，指數退避（上限 1 秒）不超過 10 次
+    assert mock_try_acquire.call_count <= 10
+
+def test_unreachable_redis_falls_back_to_local_state(stand_in_server):
+    """測試 Redis 無法連線時改用程序內狀態，請求仍正常進行"""
+    scraper = make_scraper(stand_in_server, ConcurrencyController(
+        redis_url="redis://127.0.0.1:1/0",
+        initial_limit=3,
+        max_limit=3
+    ))
+    results = run_requests(scraper, 12)
+
+    assert all(result['name'] == '測試商品' for result in results)
+    assert stand_in_server.peak == 3
+    assert host_status(scraper)['in_flight'] == 0
+
+def test_redis_state_shared_across_controllers(stand_in_server, redis_url):
+    """測試多個程序（以各自的控制器模擬）共用 Redis 上的上限與調整紀錄"""
+    scrapers = [
+        make_scraper(stand_in_server, ConcurrencyController(redis_url=redis_url, initial_limit=3, max_limit=3))
+        for _ in range(2)
+    ]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(lambda scraper: run_requests(scraper, 20), scrapers))
+    assert stand_in_server.peak == 3
+
+    stand_in_server.mode = "error"
+    run_requests(scrapers[0], 4)
+
+    # 未送出任何請求的控制器（如 API 程序）也能看到工作者記錄的狀態
+    status = host_status(make_scraper(stand_in_server, ConcurrencyController(redis_url=redis_url)))
+    assert status['limit'] == 1
+    assert status['in_flight'] == 0
+    assert status['history'][-1]['reason'] == 'status 503'
@@ -0,0 +1,92 @@
+import csv
+import io
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from price_scraper.models import Base, TaskResult
+from price_scraper.export import ExportFormat, flatten_task_result, iter_product_rows, stream_export
+
+START = datetime(2025, 1, 1)
+
+SEARCH_RESULT = [
+    {
+        "url": "https://www.momoshop.com.tw/search/searchShop.jsp?keyword=test",
+        "data": [
+            {"id": "8531744", "name": "測試商品1", "url": "https://www.momoshop.com.tw/goods/GoodsDetail.jsp?i_code=8531744"},
+            {"id": "8531745", "name": "測試商品2", "url": "https://www.momoshop.com.tw/goods/GoodsDetail.jsp?i_code=8531745"}
+        ]
+    },
+    {
+        "url": "https://24h.pchome.com.tw/prod/TEST-123",
+        "data": {"name": "測試商品3", "price": "1000", "url": "https://24h.pchome.com.tw/prod/TEST-123"}
+    },
+    {"url": "https://24h.pchome.com.tw/prod/TEST-456", "error": "測試錯誤"}
+]
+
+@pytest.fixture
+def session_factory():
+    """建立含測試資料的記憶體資料庫"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as db:
+        for i in range(3):
+            db.add(TaskResult(
+                id=f"task-{i}",
+                status="SUCCESS",
+                result=SEARCH_RESULT,
+                created_at=START + timedelta(days=i)
+            ))
+        db.add(TaskResult(
+            id="task-momo-only",
+            status="SUCCESS",
+            result=SEARCH_RESULT[:1],
+            created_at=START + timedelta(days=3)
+        ))
+        db.add(TaskResult(id="task-pending", status="PENDING", result=None, created_at=START))
+        db.commit()
+    return factory
+
+def test_flatten_task_result():
+    """測試搜尋與商品頁結果攤平成商品列，並略過錯誤項目"""
+    rows = list(flatten_task_result("task-0", START, SEARCH_RESULT))
+
+    assert [row['product_id'] for row in rows] == ['8531744', '8531745', 'TEST-123']
+    assert [row['platform'] for row in rows] == ['momo', 'momo', 'pchome']
+    assert rows[2]['price'] == '1000'
+
+def test_stream_csv_with_filters(session_factory):
+    """測試依平台與時間區間匯出 CSV"""
+    chunks = stream_export(
+        session_factory(),
+        ExportFormat.CSV,
+        platform="momo",
+        start=START + timedelta(days=1),
+        end=START + timedelta(days=2)
+    )
+    rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode("utf-8"))))
+
+    assert len(rows) == 2
+    assert {row['task_id'] for row in rows} == {'task-1'}
+    assert {row['platform'] for row in rows} == {'momo'}
+
+def test_stream_parquet(session_factory):
+    """測試匯出 Parquet 並可由 pyarrow 讀回"""
+    data = b"".join(stream_export(session_factory(), ExportFormat.PARQUET))
+    table = pq.read_table(io.BytesIO(data))
+
+    assert table.num_rows == 11
+    assert table.column_names == ['task_id', 'created_at', 'platform', 'product_id', 'name', 'price', 'url']
+    assert 'task-pending' not in table.column('task_id').to_pylist()
+
+def test_platform_filter_skips_tasks_in_sql(session_factory):
+    """測試不含目標平台的任務在資料庫端即被排除"""
+    with patch('price_scraper.export.flatten_task_result', wraps=flatten_task_result) as mock_flatten:
+        rows = list(iter_product_rows(session_factory(), platform="pchome"))
+
+    assert len(rows) == 3
+    assert 'task-momo-only' not in [call.args[0] for call in mock_flatten.call_args_list]
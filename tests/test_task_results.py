@@ -0,0 +1,122 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from price_scraper.models import Base, TaskResult, TaskResultArchive
+from price_scraper.api import ScrapeRequest, scrape_products, get_task_status, list_tasks
+from price_scraper.worker import purge_task_results_task, scrape_product_task
+from price_scraper.manage import create_indexes
+
+@pytest.fixture
+def session_factory():
+    """建立記憶體資料庫的 Session 工廠"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+def add_tasks(session_factory, count, created_at, status="SUCCESS"):
+    """新增指定數量的任務資料列"""
+    with session_factory() as db:
+        for i in range(count):
+            db.add(TaskResult(
+                id=f"{status.lower()}-{i}",
+                status=status,
+                result=None,
+                created_at=created_at + timedelta(minutes=i)
+            ))
+        db.commit()
+
+@patch('price_scraper.api.scrape_product_task')
+def test_scrape_writes_row_before_dispatch(mock_task, session_factory):
+    """測試 /scrape 在送出任務前寫入資料列，且狀態查詢不需結果後端"""
+    def assert_row_exists(args, task_id):
+        with session_factory() as db:
+            assert db.get(TaskResult, task_id).status == "PENDING"
+
+    mock_task.apply_async.side_effect = assert_row_exists
+    request = ScrapeRequest(urls=["https://24h.pchome.com.tw/prod/TEST-123"])
+
+    response = asyncio.run(scrape_products(request, db=session_factory()))
+    status = asyncio.run(get_task_status(response.task_id, db=session_factory()))
+
+    mock_task.apply_async.assert_called_once()
+    mock_task.AsyncResult.assert_not_called()
+    assert status['status'] == "PENDING"
+
+def test_list_tasks_keyset_pagination(session_factory):
+    """測試依建立時間由新到舊分頁列出任務，並可依狀態篩選"""
+    start = datetime(2025, 1, 1)
+    add_tasks(session_factory, 5, start, status="FAILURE")
+    add_tasks(session_factory, 3, start, status="SUCCESS")
+
+    seen = []
+    cursor = None
+    while True:
+        page = list_tasks(status="FAILURE", limit=2, cursor=cursor, db=session_factory())
+        seen.extend(task.task_id for task in page.tasks)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+
+    assert seen == [f"failure-{i}" for i in reversed(range(5))]
+
+def test_purge_task_results_archives_in_batches(session_factory):
+    """測試分批封存並刪除超過保留期限的任務結果"""
+    now = datetime.utcnow()
+    add_tasks(session_factory, 5, now - timedelta(days=60))
+    add_tasks(session_factory, 2, now, status="PENDING")
+    add_tasks(session_factory, 1, now - timedelta(days=60), status="STARTED")
+
+    with patch('price_scraper.worker.SessionLocal', session_factory):
+        purged = purge_task_results_task(retention_days=30, batch_size=2, archive=True)
+
+    with session_factory() as db:
+        assert purged == 5
+        assert {task.id for task in db.query(TaskResult)} == {"pending-0", "pending-1", "started-0"}
+        assert db.query(TaskResultArchive).count() == 5
+
+def test_purge_marks_stale_unfinished_tasks_failed(session_factory):
+    """測試長時間未更新的 PENDING / STARTED 任務被標記為 FAILURE"""
+    now = datetime.utcnow()
+    with session_factory() as db:
+        db.add(TaskResult(id="lost", status="PENDING", created_at=now - timedelta(days=2), updated_at=now - timedelta(days=2)))
+        db.add(TaskResult(id="running", status="STARTED", created_at=now - timedelta(hours=1), updated_at=now - timedelta(hours=1)))
+        db.commit()
+
+    with patch('price_scraper.worker.SessionLocal', session_factory):
+        purge_task_results_task(retention_days=30, stale_hours=24)
+
+    with session_factory() as db:
+        assert db.get(TaskResult, "lost").status == "FAILURE"
+        assert '視為遺失' in db.get(TaskResult, "lost").result['error']
+        assert db.get(TaskResult, "running").status == "STARTED"
+
+@patch('price_scraper.worker.scrape_urls', side_effect=RuntimeError('測試錯誤'))
+def test_task_failure_marks_row_failed(mock_scrape_urls, session_factory):
+    """測試爬蟲任務拋出例外時資料列標記為 FAILURE"""
+    add_tasks(session_factory, 1, datetime.utcnow(), status="PENDING")
+
+    with patch('price_scraper.worker.SessionLocal', session_factory):
+        scrape_product_task.apply(args=[["https://24h.pchome.com.tw/prod/TEST-123"]], task_id="pending-0")
+
+    with session_factory() as db:
+        db_task = db.get(TaskResult, "pending-0")
+        assert db_task.status == "FAILURE"
+        assert '測試錯誤' in db_task.result['error']
+
+def test_create_indexes_on_existing_table():
+    """測試為沒有索引的既有資料表補建索引，且可重複執行"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for index in TaskResult.__table__.indexes:
+            conn.execute(text(f"DROP INDEX {index.name}"))
+
+    create_indexes(engine)
+    create_indexes(engine)
+
+    names = {index['name'] for index in inspect(engine).get_indexes("task_results")}
+    assert names == {"ix_task_results_created_at", "ix_task_results_status_created_at"}